@@ -1,15 +1,20 @@
 import sys
-from flask import Flask, request, abort
+from flask import Flask, request, abort, jsonify
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import *
 import os
+import json
+import re
+import tempfile
 import datetime
 from dotenv import load_dotenv
 from io import BytesIO
 import time
 from ssl import SSLError
 import threading
+from collections import deque
+from functools import wraps
 from googleapiclient.http import MediaIoBaseDownload  # 用於下載 Google Drive 檔案
 
 # ---------------------
@@ -109,7 +114,9 @@ def get_or_create_drive_subfolder(folder_name, parent_folder_id):
             'mimeType': 'application/vnd.google-apps.folder',
             'parents': [parent_folder_id]
         }
-        folder = drive_service.files().create(body=file_metadata, fields='id').execute()
+        folder = drive_service.files().create(body=file_metadata, fields=DRIVE_FILE_FIELDS).execute()
+        with mirror_lock:
+            mirror_put(folder)
         return folder.get('id')
 
 # ---------------------
@@ -118,6 +125,7 @@ def get_or_create_drive_subfolder(folder_name, parent_folder_id):
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.errors import HttpError
 
 SCOPES = ['https://www.googleapis.com/auth/drive']
 credentials = service_account.Credentials.from_service_account_file(GOOGLE_SERVICE_ACCOUNT_FILE, scopes=SCOPES)
@@ -131,8 +139,10 @@ def upload_to_drive(stream, file_name, mime_type, folder_id=None, retry=5):
                 file_metadata['parents'] = [folder_id]
             media = MediaIoBaseUpload(stream, mimetype=mime_type)
             uploaded_file = drive_service.files().create(
-                body=file_metadata, media_body=media, fields='id'
+                body=file_metadata, media_body=media, fields=DRIVE_FILE_FIELDS
             ).execute()
+            with mirror_lock:
+                mirror_put(uploaded_file)
             drive_service.permissions().create(
                 fileId=uploaded_file.get('id'),
                 body={'type': 'anyone', 'role': 'reader'}
@@ -149,6 +159,233 @@ def upload_to_drive(stream, file_name, mime_type, folder_id=None, retry=5):
 def get_drive_file_link(file_id):
     return f"https://drive.google.com/file/d/{file_id}/view?usp=sharing"
 
+# ---------------------
+# Google Drive 中繼資料本地鏡像（@列表、@關鍵字 由此查詢，不需每次呼叫 Drive API）
+# 以 changes feed 搭配儲存的 page token 增量更新
+# ---------------------
+# 鏡像檔不可放在 DATA_DIR（Flask 靜態目錄），否則會被公開下載
+DRIVE_MIRROR_DIR = os.getenv("DRIVE_MIRROR_DIR", BASE_DIR)
+DRIVE_MIRROR_FILE = os.path.join(DRIVE_MIRROR_DIR, "drive_mirror.json")
+DRIVE_SYNC_INTERVAL = int(os.getenv("DRIVE_SYNC_INTERVAL", 30))
+DRIVE_FILE_FIELDS = "id, name, mimeType, parents, modifiedTime, trashed"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+# 每頁顯示的檔案數量
+LIST_PAGE_SIZE = 50
+# 鏡像內容：{ <檔案ID>: { "name", "mimeType", "parents", "modifiedTime" } }
+drive_mirror = {}
+# 父資料夾索引：{ <父資料夾ID>: { <子項目ID>, ... } }
+drive_children = {}
+drive_page_token = None
+mirror_lock = threading.Lock()
+# 鏡像首次載入或建立完成後才會設定，未完成前查詢指令回覆同步中
+drive_mirror_ready = threading.Event()
+drive_mirror_started = False
+
+def save_drive_mirror():
+    # 在鎖內複製快照，寫檔時不持有鎖，避免阻塞上傳
+    with mirror_lock:
+        snapshot = {"page_token": drive_page_token, "files": dict(drive_mirror)}
+    os.makedirs(DRIVE_MIRROR_DIR, exist_ok=True)
+    # 每個行程使用各自的暫存檔，多行程同時寫入時不會互相覆蓋
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=DRIVE_MIRROR_DIR,
+                                     prefix="drive_mirror.", suffix=".tmp", delete=False) as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(f.name, DRIVE_MIRROR_FILE)
+
+def index_mirror(files):
+    children = {}
+    for file_id, file in files.items():
+        for parent_id in file["parents"]:
+            children.setdefault(parent_id, set()).add(file_id)
+    return children
+
+def replace_drive_mirror(files, page_token):
+    global drive_mirror, drive_children, drive_page_token
+    children = index_mirror(files)
+    with mirror_lock:
+        drive_mirror = files
+        drive_children = children
+        drive_page_token = page_token
+    drive_mirror_ready.set()
+
+def load_drive_mirror():
+    if not os.path.exists(DRIVE_MIRROR_FILE):
+        return False
+    try:
+        with open(DRIVE_MIRROR_FILE, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 無法讀取雲端鏡像檔，將重新建立，錯誤: {e}")
+        return False
+    if not isinstance(saved, dict) or not saved.get("page_token"):
+        return False
+    try:
+        replace_drive_mirror(saved.get("files", {}), saved["page_token"])
+    except (AttributeError, KeyError, TypeError) as e:
+        print(f"⚠️ 雲端鏡像檔格式錯誤，將重新建立，錯誤: {e}")
+        return False
+    return True
+
+def mirror_remove(file_id):
+    # 呼叫者須持有 mirror_lock
+    old = drive_mirror.pop(file_id, None)
+    if old:
+        for parent_id in old["parents"]:
+            drive_children.get(parent_id, set()).discard(file_id)
+
+def mirror_put(file):
+    # 呼叫者須持有 mirror_lock
+    mirror_remove(file["id"])
+    if file.get("trashed"):
+        return
+    drive_mirror[file["id"]] = {
+        "name": file.get("name", ""),
+        "mimeType": file.get("mimeType", ""),
+        "parents": file.get("parents", []),
+        "modifiedTime": file.get("modifiedTime", ""),
+    }
+    for parent_id in drive_mirror[file["id"]]["parents"]:
+        drive_children.setdefault(parent_id, set()).add(file["id"])
+
+def rebuild_drive_mirror():
+    # 先取得起始 token，再完整列出檔案，確保列出期間的變更不會遺漏
+    start_token = drive_service.changes().getStartPageToken().execute().get("startPageToken")
+    files = {}
+    page_token = None
+    while True:
+        response = drive_service.files().list(
+            q="trashed = false", spaces="drive", pageSize=1000, pageToken=page_token,
+            fields=f"nextPageToken, files({DRIVE_FILE_FIELDS})"
+        ).execute()
+        for file in response.get("files", []):
+            files[file["id"]] = {
+                "name": file.get("name", ""),
+                "mimeType": file.get("mimeType", ""),
+                "parents": file.get("parents", []),
+                "modifiedTime": file.get("modifiedTime", ""),
+            }
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+    replace_drive_mirror(files, start_token)
+    save_drive_mirror()
+
+def sync_drive_mirror():
+    global drive_page_token
+    with mirror_lock:
+        page_token = drive_page_token
+    changed = False
+    while page_token:
+        response = drive_service.changes().list(
+            pageToken=page_token, spaces="drive", pageSize=1000,
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({DRIVE_FILE_FIELDS}))"
+        ).execute()
+        with mirror_lock:
+            for change in response.get("changes", []):
+                changed = True
+                if change.get("removed") or "file" not in change:
+                    mirror_remove(change["fileId"])
+                else:
+                    mirror_put(change["file"])
+            if "newStartPageToken" in response:
+                changed = changed or response["newStartPageToken"] != drive_page_token
+                drive_page_token = response["newStartPageToken"]
+                page_token = None
+            else:
+                page_token = response.get("nextPageToken")
+    if changed:
+        save_drive_mirror()
+
+def drive_mirror_worker():
+    loaded = False
+    while True:
+        try:
+            if not drive_mirror_ready.is_set():
+                if loaded or not load_drive_mirror():
+                    rebuild_drive_mirror()
+            else:
+                try:
+                    sync_drive_mirror()
+                except HttpError as e:
+                    # 4xx（例如儲存的 page token 已失效）重試也不會成功，改為重新建立鏡像
+                    if not 400 <= e.resp.status < 500:
+                        raise
+                    print(f"⚠️ 雲端變更同步失敗，重新建立鏡像，錯誤: {e}")
+                    rebuild_drive_mirror()
+        except Exception as e:
+            print(f"⚠️ 同步雲端鏡像失敗，錯誤: {e}")
+        loaded = True
+        time.sleep(DRIVE_SYNC_INTERVAL)
+
+def ensure_drive_mirror_started():
+    # 僅在有人使用雲端功能時才啟動同步，避免未使用雲端時仍列出整個 Drive
+    global drive_mirror_started
+    with mirror_lock:
+        if drive_mirror_started:
+            return
+        drive_mirror_started = True
+    threading.Thread(target=drive_mirror_worker, daemon=True).start()
+
+def find_mirror_child(name, parent_id):
+    for file_id in drive_children.get(parent_id, ()):
+        file = drive_mirror[file_id]
+        if file["name"] == name and file["mimeType"] == FOLDER_MIME_TYPE:
+            return file_id
+    return None
+
+def list_mirror_files(parent_folder_id, group_name, keyword=None):
+    """自鏡像取得群組資料夾下 images/files/videos 的檔案，回傳 { 類別: [檔案, ...] }"""
+    result = {"images": [], "files": [], "videos": []}
+    with mirror_lock:
+        group_folder = find_mirror_child(group_name, parent_folder_id)
+        if not group_folder:
+            return result
+        for category in result:
+            cat_folder = find_mirror_child(category, group_folder)
+            if not cat_folder:
+                continue
+            for file_id in drive_children.get(cat_folder, ()):
+                file = drive_mirror[file_id]
+                if file["mimeType"] == FOLDER_MIME_TYPE:
+                    continue
+                if keyword and keyword.lower() not in file["name"].lower():
+                    continue
+                result[category].append(dict(file, id=file_id))
+    for files in result.values():
+        files.sort(key=lambda f: f["modifiedTime"], reverse=True)
+    return result
+
+def split_page_marker(text):
+    """拆出結尾的「第N頁」標記，回傳 (其餘文字, 頁數)；無標記時頁數為 1"""
+    parts = text.rsplit(" ", 1)
+    match = re.fullmatch(r"第([0-9]+)頁", parts[-1])
+    if not match:
+        return text, 1
+    return (parts[0] if len(parts) == 2 else "").strip(), int(match.group(1))
+
+def format_mirror_listing(title, files_by_category, page, command):
+    categories = {"images": "圖片", "files": "檔案", "videos": "影片"}
+    entries = []
+    for category, display in categories.items():
+        for file in files_by_category[category]:
+            entries.append((display, file))
+    if not entries:
+        return f"{title}\n找不到符合的檔案。"
+    total_pages = (len(entries) + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    page = min(max(page, 1), total_pages)
+    message_lines = [f"{title}（第 {page}/{total_pages} 頁，共 {len(entries)} 筆）"]
+    current_display = None
+    for display, file in entries[(page - 1) * LIST_PAGE_SIZE:page * LIST_PAGE_SIZE]:
+        if display != current_display:
+            message_lines.append(f"\n【{display}】")
+            current_display = display
+        modified = file["modifiedTime"][:19].replace("T", " ")
+        message_lines.append(f"{file['name']} (修改時間: {modified})")
+        message_lines.append(get_drive_file_link(file["id"]))
+    if page < total_pages:
+        message_lines.append(f"\n輸入「{command} 第{page + 1}頁」查看下一頁")
+    return "\n".join(message_lines)
+
 # ---------------------
 # 輔助函式：取得群組與使用者名稱
 # ---------------------
@@ -163,6 +400,9 @@ def get_group_name(event):
             return f"群組_{group_id}"
     return "個人聊天"
 
+def get_event_key(event):
+    return event.source.group_id if isinstance(event.source, SourceGroup) else event.source.user_id
+
 def get_user_name(event):
     try:
         if isinstance(event.source, SourceGroup):
@@ -176,6 +416,181 @@ def get_user_name(event):
     except Exception:
         return "未知用戶"
 
+# ---------------------
+# 上傳流量控制（admission control）：限制同時處理中的上傳數量與位元組數，
+# 超過上限時將低優先度工作（影片、大型檔案）延後處理，延後佇列已滿則直接拒絕
+# ---------------------
+MAX_INFLIGHT_JOBS = int(os.getenv("MAX_INFLIGHT_JOBS", 8))
+MAX_INFLIGHT_BYTES = int(os.getenv("MAX_INFLIGHT_BYTES", 200 * 1024 * 1024))
+MAX_DEFERRED_JOBS = int(os.getenv("MAX_DEFERRED_JOBS", 100))
+# 低優先度工作只能使用上限的一部分，保留空間給圖片等小型上傳
+LOW_PRIORITY_RATIO = float(os.getenv("LOW_PRIORITY_RATIO", 0.5))
+LARGE_PAYLOAD_BYTES = int(os.getenv("LARGE_PAYLOAD_BYTES", 20 * 1024 * 1024))
+# 圖片與影片訊息不提供檔案大小，先以預估值保留額度，開始下載時再依 Content-Length 修正
+IMAGE_SIZE_ESTIMATE = int(os.getenv("IMAGE_SIZE_ESTIMATE", 5 * 1024 * 1024))
+VIDEO_SIZE_ESTIMATE = int(os.getenv("VIDEO_SIZE_ESTIMATE", 50 * 1024 * 1024))
+
+admission_cond = threading.Condition()
+inflight_jobs = 0
+inflight_bytes = 0
+# 延後處理的工作：(處理函式, event, 預估大小, 是否為低優先度)
+deferred_jobs = deque()
+# 目前執行緒所處理工作的保留位元組數（下載時會依 Content-Length 修正）
+admission_local = threading.local()
+
+def estimate_payload_size(event):
+    if isinstance(event.message, FileMessage):
+        return event.message.file_size or LARGE_PAYLOAD_BYTES
+    if isinstance(event.message, VideoMessage):
+        return VIDEO_SIZE_ESTIMATE
+    return IMAGE_SIZE_ESTIMATE
+
+def is_low_priority(event, size):
+    return isinstance(event.message, VideoMessage) or size >= LARGE_PAYLOAD_BYTES
+
+def try_admit(size, low_priority):
+    # 呼叫者須持有 admission_cond
+    global inflight_jobs, inflight_bytes
+    ratio = LOW_PRIORITY_RATIO if low_priority else 1.0
+    if inflight_jobs >= max(1, int(MAX_INFLIGHT_JOBS * ratio)):
+        return False
+    # 無其他工作時一律放行，避免單一超大檔案永遠無法處理
+    if inflight_jobs and inflight_bytes + size > MAX_INFLIGHT_BYTES * ratio:
+        return False
+    inflight_jobs += 1
+    inflight_bytes += size
+    return True
+
+def release_admission(size):
+    global inflight_jobs, inflight_bytes
+    with admission_cond:
+        inflight_jobs -= 1
+        inflight_bytes -= size
+        admission_cond.notify_all()
+
+def is_saturated():
+    with admission_cond:
+        return (inflight_jobs >= MAX_INFLIGHT_JOBS
+                or inflight_bytes >= MAX_INFLIGHT_BYTES
+                or len(deferred_jobs) >= MAX_DEFERRED_JOBS)
+
+class PayloadOverLimit(Exception):
+    """實際內容大小超過流量上限，工作須改為延後處理"""
+
+    def __init__(self, size):
+        super().__init__(f"payload of {size} bytes exceeds the in-flight limit")
+        self.size = size
+
+def reserve_actual_size(content):
+    # 在上傳處理函式內呼叫：以 Content-Length 修正預估的保留額度，
+    # 若修正後超過上限且仍有其他工作進行中，則拋出 PayloadOverLimit 改為延後處理
+    global inflight_bytes
+    length = content.response.headers.get("content-length")
+    if not length or not length.isdecimal():
+        return
+    actual = int(length)
+    with admission_cond:
+        delta = actual - admission_local.size
+        if delta > 0 and inflight_jobs > 1 and inflight_bytes + delta > MAX_INFLIGHT_BYTES:
+            raise PayloadOverLimit(actual)
+        inflight_bytes += delta
+        admission_local.size = actual
+        if delta < 0:
+            admission_cond.notify_all()
+
+def reply_upload_result(event, message, deferred):
+    # 延後處理的工作其 reply token 可能已用於「已排入佇列」回覆，改以 push 傳送結果
+    if deferred:
+        line_bot_api.push_message(get_event_key(event), message)
+    else:
+        line_bot_api.reply_message(event.reply_token, message)
+
+def defer_job(func, event, size, low_priority):
+    with admission_cond:
+        queued = len(deferred_jobs) < MAX_DEFERRED_JOBS
+        if queued:
+            deferred_jobs.append((func, event, size, low_priority))
+            admission_cond.notify_all()
+    if reply_enabled.get(get_event_key(event), False):
+        text = "⏳ 系統忙碌中，已排入佇列，稍後處理完成會再通知。" if queued else "⚠️ 系統忙碌中，請稍後再傳送。"
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=text))
+
+def admission_controlled(func):
+    @wraps(func)
+    def wrapper(event):
+        size = estimate_payload_size(event)
+        low_priority = is_low_priority(event, size)
+        with admission_cond:
+            # 已有延後工作時，低優先度工作須排隊，避免插隊
+            admitted = not (low_priority and deferred_jobs) and try_admit(size, low_priority)
+        if not admitted:
+            defer_job(func, event, size, low_priority)
+            return
+        admission_local.size = size
+        try:
+            func(event)
+        except PayloadOverLimit as e:
+            defer_job(func, event, e.size, True)
+        finally:
+            release_admission(admission_local.size)
+    return wrapper
+
+def pop_admissible_deferred_job():
+    # 呼叫者須持有 admission_cond；依序找出第一個可放行的工作，
+    # 避免排在前面的低優先度工作卡住後面的圖片等高優先度工作
+    for job in deferred_jobs:
+        if try_admit(job[2], job[3]):
+            deferred_jobs.remove(job)
+            return job
+    return None
+
+def deferred_job_worker():
+    while True:
+        with admission_cond:
+            job = pop_admissible_deferred_job()
+            while job is None:
+                admission_cond.wait()
+                job = pop_admissible_deferred_job()
+        func, event, size, _ = job
+        admission_local.size = size
+        try:
+            func(event, deferred=True)
+        except PayloadOverLimit as e:
+            # 實際大小超過預估，以實際大小重新排回佇列最前面，等待額度釋出
+            with admission_cond:
+                deferred_jobs.appendleft((func, event, e.size, True))
+        except Exception as e:
+            print(f"⚠️ 延後處理的上傳失敗，錯誤: {e}")
+            key = get_event_key(event)
+            if reply_enabled.get(key, False):
+                try:
+                    line_bot_api.push_message(key, TextSendMessage(text="⚠️ 排入佇列的上傳處理失敗，請重新傳送。"))
+                except Exception as push_error:
+                    print(f"⚠️ 無法通知上傳失敗，錯誤: {push_error}")
+        finally:
+            release_admission(admission_local.size)
+
+threading.Thread(target=deferred_job_worker, daemon=True).start()
+
+# ---------------------
+# 健康檢查：負載飽和時回傳 503，供負載平衡器將流量導向其他實例
+# ---------------------
+@app.route("/health", methods=['GET'])
+def health():
+    with admission_cond:
+        saturated = is_saturated()
+        status = {
+            "status": "saturated" if saturated else "ok",
+            "inflight_jobs": inflight_jobs,
+            "max_inflight_jobs": MAX_INFLIGHT_JOBS,
+            # 保留的位元組數：下載開始前為預估值，取得 Content-Length 後為實際大小
+            "inflight_bytes": inflight_bytes,
+            "max_inflight_bytes": MAX_INFLIGHT_BYTES,
+            "deferred_jobs": len(deferred_jobs),
+            "max_deferred_jobs": MAX_DEFERRED_JOBS,
+        }
+    return jsonify(status), 503 if saturated else 200
+
 # ---------------------
 # LINE Bot Webhook 處理
 # ---------------------
@@ -221,6 +636,9 @@ def handle_text_message(event):
             "  @設定雲端資料夾 <資料夾ID>：設定上傳至 Google Drive 的目標父資料夾ID。\n"
             "  @開啟雲端上傳：啟用雲端上傳，檔案將上傳至 Google Drive 中，系統會在指定父資料夾下建立以群組名稱命名的子資料夾，再於該資料夾下建立 images、files、videos 子資料夾，最後將檔案上傳至對應的子資料夾中。"
             "  @關閉雲端上傳：停用雲端上傳。\n\n"
+            "【雲端查詢指令】\n"
+            "  @列表 [第N頁]：列出雲端資料夾中本群組的 images、files、videos 檔案，每頁 50 筆。\n"
+            "  @關鍵字 <關鍵字> [第N頁]：搜尋雲端資料夾中檔名包含關鍵字的檔案（不區分大小寫）。\n\n"
             "【其他指令】\n"
             "  @檢查群組：查詢目前對話所在的群組名稱（個人聊天則顯示『個人聊天』）。\n"
             "  @幫助：顯示本使用說明資訊。\n\n"
@@ -249,6 +667,7 @@ def handle_text_message(event):
             line_bot_api.reply_message(event.reply_token, reply)
             return
         storage_settings[key]["cloud"] = True
+        ensure_drive_mirror_started()
         reply = TextSendMessage(text="✅ 已開啟雲端上傳。")
         line_bot_api.reply_message(event.reply_token, reply)
     elif user_message == "@關閉雲端上傳":
@@ -265,16 +684,60 @@ def handle_text_message(event):
         user_drive_folder[key] = folder_id
         reply = TextSendMessage(text=f"✅ 已設定上傳至 Google Drive 的資料夾ID為：{folder_id}")
         line_bot_api.reply_message(event.reply_token, reply)
+    # 【雲端檔案列表】功能，格式：@列表 [第N頁]，由本地鏡像查詢
+    elif user_message == "@列表" or user_message.startswith("@列表 "):
+        parent_folder_id = user_drive_folder.get(key, GOOGLE_DRIVE_FOLDER_ID)
+        if not parent_folder_id:
+            reply = TextSendMessage(text="❌ 尚未設定雲端資料夾ID，請先使用 @設定雲端資料夾 <資料夾ID> 指令設定。")
+            line_bot_api.reply_message(event.reply_token, reply)
+            return
+        ensure_drive_mirror_started()
+        if not drive_mirror_ready.is_set():
+            reply = TextSendMessage(text="⏳ 雲端檔案索引同步中，請稍後再試。")
+            line_bot_api.reply_message(event.reply_token, reply)
+            return
+        _, page = split_page_marker(user_message)
+        files_by_category = list_mirror_files(parent_folder_id, get_group_name(event))
+        final_message = format_mirror_listing("【雲端檔案列表】", files_by_category, page, "@列表")
+        send_long_message(event.reply_token, final_message)
+    # 【雲端關鍵字搜尋】功能，格式：@關鍵字 <關鍵字> [第N頁]，由本地鏡像查詢
+    elif user_message.startswith("@關鍵字"):
+        parent_folder_id = user_drive_folder.get(key, GOOGLE_DRIVE_FOLDER_ID)
+        if not parent_folder_id:
+            reply = TextSendMessage(text="❌ 尚未設定雲端資料夾ID，請先使用 @設定雲端資料夾 <資料夾ID> 指令設定。")
+            line_bot_api.reply_message(event.reply_token, reply)
+            return
+        ensure_drive_mirror_started()
+        if not drive_mirror_ready.is_set():
+            reply = TextSendMessage(text="⏳ 雲端檔案索引同步中，請稍後再試。")
+            line_bot_api.reply_message(event.reply_token, reply)
+            return
+        parts = user_message.split(" ", 1)
+        if len(parts) < 2 or not parts[1].strip():
+            reply = TextSendMessage(text="請輸入要搜尋的關鍵字，例如：@關鍵字 test")
+            line_bot_api.reply_message(event.reply_token, reply)
+            return
+        keyword, page = split_page_marker(parts[1].strip())
+        if not keyword:
+            reply = TextSendMessage(text="請輸入要搜尋的關鍵字，例如：@關鍵字 test")
+            line_bot_api.reply_message(event.reply_token, reply)
+            return
+        files_by_category = list_mirror_files(parent_folder_id, get_group_name(event), keyword)
+        final_message = format_mirror_listing(
+            f"【包含關鍵字 '{keyword}' 的雲端檔案】", files_by_category, page, f"@關鍵字 {keyword}"
+        )
+        send_long_message(event.reply_token, final_message)
     
 
 # ---------------------
 # 處理圖片訊息（支援本地存儲與雲端上傳）
 # ---------------------
 @handler.add(MessageEvent, message=ImageMessage)
-def handle_image_message(event):
+@admission_controlled
+def handle_image_message(event, deferred=False):
     with upload_lock:
         user_name = get_user_name(event)
-        key = event.source.group_id if isinstance(event.source, SourceGroup) else event.source.user_id
+        key = get_event_key(event)
         group_name_val = get_group_name(event)
         # 取得父資料夾ID：使用者設定的雲端資料夾或預設值
         parent_folder_id = user_drive_folder.get(key, GOOGLE_DRIVE_FOLDER_ID)
@@ -292,6 +755,7 @@ def handle_image_message(event):
         file_name = get_unique_uploaded_filename(uploaded_files[key]["images"], file_name)
         stream = BytesIO()
         image_content = line_bot_api.get_message_content(image_id)
+        reserve_actual_size(image_content)
         for chunk in image_content.iter_content():
             stream.write(chunk)
         stream.seek(0)
@@ -326,16 +790,17 @@ def handle_image_message(event):
                     msg_parts.append(f"雲端連結：{cloud_link}")
                 msg = "\n".join(msg_parts)
             reply = TextSendMessage(text="📸 " + msg)
-            line_bot_api.reply_message(event.reply_token, reply)
+            reply_upload_result(event, reply, deferred)
 
 # ---------------------
 # 處理檔案訊息（支援本地存儲與雲端上傳）
 # ---------------------
 @handler.add(MessageEvent, message=FileMessage)
-def handle_file_message(event):
+@admission_controlled
+def handle_file_message(event, deferred=False):
     with upload_lock:
         user_name = get_user_name(event)
-        key = event.source.group_id if isinstance(event.source, SourceGroup) else event.source.user_id
+        key = get_event_key(event)
         group_name_val = get_group_name(event)
         parent_folder_id = user_drive_folder.get(key, GOOGLE_DRIVE_FOLDER_ID)
         if storage_settings.get(key, {}).get("cloud", False) and parent_folder_id:
@@ -351,6 +816,7 @@ def handle_file_message(event):
         file_name = get_unique_uploaded_filename(uploaded_files[key]["files"], file_name)
         stream = BytesIO()
         file_content = line_bot_api.get_message_content(file_id_msg)
+        reserve_actual_size(file_content)
         for chunk in file_content.iter_content():
             stream.write(chunk)
         stream.seek(0)
@@ -388,16 +854,17 @@ def handle_file_message(event):
                     msg_parts.append(f"雲端連結：{cloud_link}")
                 msg = "\n".join(msg_parts)
             reply = TextSendMessage(text="📁 " + msg)
-            line_bot_api.reply_message(event.reply_token, reply)
+            reply_upload_result(event, reply, deferred)
 
 # ---------------------
 # 處理影片訊息（支援本地存儲與雲端上傳）
 # ---------------------
 @handler.add(MessageEvent, message=VideoMessage)
-def handle_video_message(event):
+@admission_controlled
+def handle_video_message(event, deferred=False):
     with upload_lock:
         user_name = get_user_name(event)
-        key = event.source.group_id if isinstance(event.source, SourceGroup) else event.source.user_id
+        key = get_event_key(event)
         group_name_val = get_group_name(event)
         parent_folder_id = user_drive_folder.get(key, GOOGLE_DRIVE_FOLDER_ID)
         if storage_settings.get(key, {}).get("cloud", False) and parent_folder_id:
@@ -412,6 +879,7 @@ def handle_video_message(event):
         file_name = get_unique_uploaded_filename(uploaded_files[key]["videos"], file_name)
         stream = BytesIO()
         video_content = line_bot_api.get_message_content(video_id)
+        reserve_actual_size(video_content)
         for chunk in video_content.iter_content():
             stream.write(chunk)
         stream.seek(0)
@@ -446,7 +914,7 @@ def handle_video_message(event):
                     msg_parts.append(f"雲端連結：{cloud_link}")
                 msg = "\n".join(msg_parts)
             reply = TextSendMessage(text="🎬 " + msg)
-            line_bot_api.reply_message(event.reply_token, reply)
+            reply_upload_result(event, reply, deferred)
 
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,18 @@
+import importlib
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="module")
+def bot():
+    os.environ.setdefault("ACCESS_TOKEN", "test-token")
+    os.environ.setdefault("CHANNEL_SECRET", "test-secret")
+    with mock.patch("google.oauth2.service_account.Credentials.from_service_account_file"), \
+            mock.patch("googleapiclient.discovery.build"):
+        module = importlib.import_module("Line_Bot_To_Google_Drive")
+    return module
@@ -0,0 +1,31 @@
+import json
+
+FOLDER = "application/vnd.google-apps.folder"
+
+
+def test_split_page_marker(bot):
+    assert bot.split_page_marker("IMG 2024") == ("IMG 2024", 1)
+    assert bot.split_page_marker("IMG 2024 第3頁") == ("IMG 2024", 3)
+    assert bot.split_page_marker("@列表 ²") == ("@列表 ²", 1)
+    assert bot.split_page_marker("第2頁") == ("", 2)
+
+
+def test_load_malformed_mirror_file_returns_false(bot, monkeypatch, tmp_path):
+    path = tmp_path / "drive_mirror.json"
+    path.write_text(json.dumps({"page_token": "t", "files": {"x": {"name": "a"}}}), encoding="utf-8")
+    monkeypatch.setattr(bot, "DRIVE_MIRROR_FILE", str(path))
+    assert bot.load_drive_mirror() is False
+
+
+def test_list_mirror_files_uses_parent_index(bot, monkeypatch):
+    files = {
+        "g": {"name": "grp", "mimeType": FOLDER, "parents": ["root"], "modifiedTime": ""},
+        "img": {"name": "images", "mimeType": FOLDER, "parents": ["g"], "modifiedTime": ""},
+        "a": {"name": "Cat-2024.jpg", "mimeType": "image/jpeg", "parents": ["img"], "modifiedTime": "2024"},
+        "b": {"name": "dog.jpg", "mimeType": "image/jpeg", "parents": ["img"], "modifiedTime": "2025"},
+    }
+    monkeypatch.setattr(bot, "drive_mirror", files)
+    monkeypatch.setattr(bot, "drive_children", bot.index_mirror(files))
+    result = bot.list_mirror_files("root", "grp")
+    assert [f["id"] for f in result["images"]] == ["b", "a"]
+    assert [f["id"] for f in bot.list_mirror_files("root", "grp", "cat-2024")["images"]] == ["a"]
@@ -0,0 +1,261 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+from linebot.models import ImageMessage, SourceUser, VideoMessage
+
+IMAGE_SIZE = 256 * 1024
+VIDEO_ESTIMATE = 1024 * 1024
+# 影片實際大小大於預估值，須由 Content-Length 修正保留額度
+VIDEO_SIZE = 2 * 1024 * 1024
+DOWNLOAD_DELAY = 0.02
+# 模擬伺服器的工作執行緒數量
+SERVER_THREADS = 8
+MEDIA_EVENTS = 40
+TEXT_EVENTS = 20
+TEXT_P99_BOUND = 0.2
+
+
+class FakeLineBotApi:
+    """取代 line_bot_api：下載時回傳固定大小內容，並記錄流量控制計數器的峰值"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.lock = threading.Lock()
+        self.replies = []
+        self.pushes = []
+        self.sizes = {}
+        self.peak_jobs = 0
+        self.peak_bytes = 0
+        self.peak_deferred = 0
+
+    def sample(self):
+        with self.bot.admission_cond:
+            jobs, size, deferred = self.bot.inflight_jobs, self.bot.inflight_bytes, len(self.bot.deferred_jobs)
+        with self.lock:
+            self.peak_jobs = max(self.peak_jobs, jobs)
+            self.peak_bytes = max(self.peak_bytes, size)
+            self.peak_deferred = max(self.peak_deferred, deferred)
+
+    def reply_message(self, reply_token, messages):
+        self.sample()
+        with self.lock:
+            self.replies.append(messages)
+
+    def push_message(self, to, messages):
+        with self.lock:
+            self.pushes.append(messages)
+
+    def get_profile(self, user_id):
+        return SimpleNamespace(display_name="tester")
+
+    def get_message_content(self, message_id):
+        self.sample()
+        size = self.sizes[message_id]
+
+        def iter_content():
+            self.sample()
+            time.sleep(DOWNLOAD_DELAY)
+            yield b"\0" * size
+
+        response = SimpleNamespace(headers={"content-length": str(size)})
+        return SimpleNamespace(response=response, iter_content=iter_content)
+
+
+class CountingLock:
+    """取代 upload_lock：記錄同時持有或等待上傳鎖的執行緒數量"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count_lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def __enter__(self):
+        with self.count_lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        self.lock.acquire()
+
+    def __exit__(self, *exc):
+        self.lock.release()
+        with self.count_lock:
+            self.current -= 1
+
+
+def make_event(message, user_id="U1"):
+    return SimpleNamespace(message=message, source=SourceUser(user_id=user_id), reply_token="token")
+
+
+def media_message(i, fake):
+    message_id = str(i)
+    if i % 2:
+        fake.sizes[message_id] = VIDEO_SIZE
+        return {"type": "video", "id": message_id, "duration": 1000, "contentProvider": {"type": "line"}}
+    fake.sizes[message_id] = IMAGE_SIZE
+    return {"type": "image", "id": message_id, "contentProvider": {"type": "line"}}
+
+
+def post_callback(bot, client, message):
+    body = json.dumps({"destination": "bot", "events": [{
+        "type": "message", "mode": "active", "timestamp": 0, "replyToken": "token",
+        "source": {"type": "user", "userId": "U1"}, "message": message,
+    }]})
+    digest = hmac.new(bot.LINE_CHANNEL_SECRET.encode(), body.encode(), hashlib.sha256).digest()
+    response = client.post("/callback", data=body, content_type="application/json",
+                           headers={"X-Line-Signature": base64.b64encode(digest).decode()})
+    assert response.status_code == 200
+
+
+def wait_until_drained(bot, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with bot.admission_cond:
+            if not bot.deferred_jobs and bot.inflight_jobs == 0:
+                return
+        time.sleep(0.01)
+    raise AssertionError("延後佇列未在時限內清空")
+
+
+def run_burst(bot, monkeypatch):
+    """以固定大小的執行緒池模擬伺服器，先送出大量上傳再送出文字指令，回傳統計結果"""
+    fake = FakeLineBotApi(bot)
+    lock = CountingLock()
+    drive = mock.MagicMock()
+    drive.files.return_value.list.return_value.execute.return_value = {"files": [{"id": "folder"}]}
+    drive.files.return_value.create.return_value.execute.return_value = {"id": "uploaded"}
+    monkeypatch.setattr(bot, "line_bot_api", fake)
+    monkeypatch.setattr(bot, "drive_service", drive)
+    monkeypatch.setattr(bot, "upload_lock", lock)
+    monkeypatch.setitem(bot.reply_enabled, "U1", True)
+    monkeypatch.setitem(bot.storage_settings, "U1", {"local": False, "cloud": True})
+    monkeypatch.setitem(bot.user_drive_folder, "U1", "root")
+    client = bot.app.test_client()
+    text_latencies = []
+
+    def send_text(submitted):
+        post_callback(bot, client, {"type": "text", "id": "t", "text": "@開啟訊息"})
+        text_latencies.append(time.perf_counter() - submitted)
+
+    with ThreadPoolExecutor(max_workers=SERVER_THREADS) as pool:
+        futures = [pool.submit(post_callback, bot, client, media_message(i, fake)) for i in range(MEDIA_EVENTS)]
+        # 文字指令的延遲從送出時起算，包含在執行緒池中排隊的時間
+        futures += [pool.submit(send_text, time.perf_counter()) for _ in range(TEXT_EVENTS)]
+        for future in futures:
+            future.result()
+    wait_until_drained(bot)
+    text_latencies.sort()
+    p99 = text_latencies[int(len(text_latencies) * 0.99) - 1]
+    return fake, lock, p99
+
+
+def test_overload_bounds_handler_threads_and_text_latency(bot, monkeypatch):
+    monkeypatch.setattr(bot, "MAX_INFLIGHT_JOBS", 4)
+    monkeypatch.setattr(bot, "MAX_INFLIGHT_BYTES", 4 * 1024 * 1024)
+    monkeypatch.setattr(bot, "MAX_DEFERRED_JOBS", 10)
+    monkeypatch.setattr(bot, "IMAGE_SIZE_ESTIMATE", IMAGE_SIZE)
+    monkeypatch.setattr(bot, "VIDEO_SIZE_ESTIMATE", VIDEO_ESTIMATE)
+    fake, lock, p99 = run_burst(bot, monkeypatch)
+
+    assert lock.peak <= bot.MAX_INFLIGHT_JOBS
+    assert fake.peak_jobs <= bot.MAX_INFLIGHT_JOBS
+    assert fake.peak_bytes <= bot.MAX_INFLIGHT_BYTES
+    assert fake.peak_deferred <= bot.MAX_DEFERRED_JOBS
+    with bot.admission_cond:
+        assert bot.inflight_jobs == 0
+        assert bot.inflight_bytes == 0
+        assert not bot.deferred_jobs
+    assert p99 < TEXT_P99_BOUND
+    # 排入佇列的工作最後都以 push 通知結果
+    assert len(fake.pushes) > 0
+
+
+def test_without_admission_control_threads_pile_up(bot, monkeypatch):
+    monkeypatch.setattr(bot, "MAX_INFLIGHT_JOBS", 10 ** 6)
+    monkeypatch.setattr(bot, "MAX_INFLIGHT_BYTES", 10 ** 12)
+    monkeypatch.setattr(bot, "LOW_PRIORITY_RATIO", 1.0)
+    fake, lock, p99 = run_burst(bot, monkeypatch)
+
+    # 對照組：所有伺服器執行緒都卡在上傳鎖，文字指令只能排隊等待
+    assert lock.peak == SERVER_THREADS
+    assert p99 >= TEXT_P99_BOUND
+
+
+def test_busy_reply_suppressed_when_replies_disabled(bot, monkeypatch):
+    fake = FakeLineBotApi(bot)
+    monkeypatch.setattr(bot, "line_bot_api", fake)
+    monkeypatch.setattr(bot, "MAX_DEFERRED_JOBS", 0)
+    monkeypatch.setitem(bot.reply_enabled, "U2", False)
+    with bot.admission_cond:
+        saved_jobs = bot.inflight_jobs
+        bot.inflight_jobs = bot.MAX_INFLIGHT_JOBS
+        try:
+            bot.handle_video_message(make_event(VideoMessage(id="busy"), user_id="U2"))
+        finally:
+            bot.inflight_jobs = saved_jobs
+    assert fake.replies == []
+
+
+def test_health_reports_saturation(bot):
+    client = bot.app.test_client()
+    assert client.get("/health").status_code == 200
+    with bot.admission_cond:
+        saved_jobs = bot.inflight_jobs
+        bot.inflight_jobs = bot.MAX_INFLIGHT_JOBS
+        try:
+            response = client.get("/health")
+        finally:
+            bot.inflight_jobs = saved_jobs
+    assert response.status_code == 503
+    assert response.get_json()["status"] == "saturated"
+
+
+def test_deferred_image_not_blocked_by_queued_video(bot):
+    video = (None, make_event(VideoMessage(id="v")), bot.VIDEO_SIZE_ESTIMATE, True)
+    image = (None, make_event(ImageMessage(id="i")), bot.IMAGE_SIZE_ESTIMATE, False)
+    # 全程持有 admission_cond，背景的延後工作執行緒無法取出測試用的工作
+    with bot.admission_cond:
+        saved = bot.deferred_jobs, bot.inflight_jobs, bot.inflight_bytes
+        bot.deferred_jobs = bot.deque([video, image])
+        # 低優先度額度已滿，但仍有高優先度額度
+        bot.inflight_jobs = int(bot.MAX_INFLIGHT_JOBS * bot.LOW_PRIORITY_RATIO)
+        bot.inflight_bytes = 0
+        try:
+            job = bot.pop_admissible_deferred_job()
+            remaining = list(bot.deferred_jobs)
+        finally:
+            bot.deferred_jobs, bot.inflight_jobs, bot.inflight_bytes = saved
+    assert job is image
+    assert remaining == [video]
+
+
+def test_reservation_corrected_from_content_length(bot):
+    content = SimpleNamespace(response=SimpleNamespace(headers={"content-length": str(VIDEO_SIZE)}))
+    with bot.admission_cond:
+        saved = bot.inflight_jobs, bot.inflight_bytes
+        try:
+            # 僅此一筆工作時依實際大小修正
+            bot.inflight_jobs, bot.inflight_bytes = 1, VIDEO_ESTIMATE
+            bot.admission_local.size = VIDEO_ESTIMATE
+            bot.reserve_actual_size(content)
+            assert bot.inflight_bytes == VIDEO_SIZE
+            assert bot.admission_local.size == VIDEO_SIZE
+            # 尚有其他工作且修正後超過上限時改為延後處理
+            bot.inflight_jobs = 2
+            bot.inflight_bytes = bot.MAX_INFLIGHT_BYTES
+            bot.admission_local.size = VIDEO_ESTIMATE
+            try:
+                bot.reserve_actual_size(content)
+            except bot.PayloadOverLimit as e:
+                assert e.size == VIDEO_SIZE
+            else:
+                raise AssertionError("應拋出 PayloadOverLimit")
+            assert bot.inflight_bytes == bot.MAX_INFLIGHT_BYTES
+        finally:
+            bot.inflight_jobs, bot.inflight_bytes = saved